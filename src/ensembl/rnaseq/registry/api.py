@@ -14,15 +14,35 @@
 # limitations under the License.
 """RNA-Seq registry API module."""
 
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
 import json
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 from os import PathLike
 
-from jsonschema import validate
-from sqlalchemy import Engine, select
-from sqlalchemy.orm import Session, joinedload
+from jsonschema import Draft7Validator
+from sqlalchemy import (
+    URL,
+    Engine,
+    Insert,
+    Row,
+    bindparam,
+    create_engine,
+    delete,
+    distinct,
+    event,
+    func,
+    insert,
+    lambda_stmt,
+    make_url,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.orm import Session, contains_eager, joinedload, selectinload, sessionmaker
 
 from ensembl.rnaseq.registry.database_schema import Base, Component, Organism, Dataset, Sample, Accession
 
@@ -33,13 +53,51 @@ __all__ = [
 
 cur_dir = Path(__file__).parent
 _RNASEQ_SCHEMA_PATH = Path(cur_dir, "schemas/brc4_rnaseq_schema.json")
+_RNASEQ_SCHEMA = json.loads(_RNASEQ_SCHEMA_PATH.read_text())
+Draft7Validator.check_schema(_RNASEQ_SCHEMA)
+_RNASEQ_VALIDATOR = Draft7Validator(_RNASEQ_SCHEMA)
+_JSON_ENCODER = json.JSONEncoder(indent=2, sort_keys=True)
+# Single-row inserts, compiled once per dialect (without RETURNING, available on any backend)
+_INSERT_COMPONENT = insert(Component).values(name=bindparam("name"))
+_INSERT_ORGANISM = insert(Organism).values(abbrev=bindparam("abbrev"), component_id=bindparam("component_id"))
+_INSERT_PAGE_SIZE = 1000
+# Values per IN list (older SQLite versions allow at most 999 parameters per statement)
+_IN_PAGE_SIZE = 900
+_COPY_THRESHOLD = 100
+_ANALYZE_THRESHOLD = 1000
+_YIELD_PER = 500
+_WRITE_BUFFER_SIZE = 1 << 20
+_POOL_OPTIONS: Dict[str, Any] = {
+    "pool_size": 20,
+    "max_overflow": 30,
+    "pool_use_lifo": True,
+    "pool_pre_ping": True,
+    "pool_recycle": 1800,
+}
+_PSYCOPG2_OPTIONS: Dict[str, Any] = {
+    "executemany_mode": "values_plus_batch",
+    "executemany_batch_page_size": 500,
+}
+
+
+def _in_pages(values: Iterable[Any]) -> Iterator[List[Any]]:
+    """Yields the values in lists small enough to be used in an IN clause."""
+    values = list(values)
+    for start in range(0, len(values), _IN_PAGE_SIZE):
+        yield values[start : start + _IN_PAGE_SIZE]
+
+
+def _check_batch_size(batch_size: Optional[int]) -> None:
+    """Raise a ValueError if the number of rows per insert batch is set but not positive."""
+    if batch_size is not None and batch_size < 1:
+        raise ValueError(f"Batch size must be a positive number (got {batch_size})")
 
 
 class DBValueError(Exception):
     """Raise if there is an issue with a data to enter in the database."""
 
 
-class RnaseqRegistry:
+class RnaseqRegistry:  # pylint: disable=too-many-public-methods
     """Interface for the RNA-Seq Registry."""
 
     def __init__(self, engine: Engine) -> None:
@@ -48,23 +106,61 @@ class RnaseqRegistry:
         Args:
             engine: Predefined engine to use.
         """
-        self.engine = engine
-        with Session(engine) as session:
-            self.session = session
+        self.engine = engine.execution_options(insertmanyvalues_page_size=_INSERT_PAGE_SIZE)
+        self._session_factory = sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.session: Session = self._session_factory()
+        self._components: Dict[str, Component] = {}
+        # Components added in a rolled back transaction are gone
+        event.listen(self.session, "after_rollback", self._clear_components)
+
+    def __enter__(self) -> "RnaseqRegistry":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the registry session: pending changes are rolled back, connections released."""
+        self.session.close()
+        self._components.clear()
+
+    @classmethod
+    def create_engine(cls, url: Union[str, URL], **kwargs: Any) -> Engine:
+        """Returns an engine tuned for the registry.
+
+        Server databases get a larger LIFO connection pool, with pre-ping and recycling of the
+        connections, while SQLite keeps its default pool. With psycopg2, executemany also uses the
+        driver's batch mode. Any keyword argument overrides those defaults.
+
+        Args:
+            url: URL of the database.
+            kwargs: Extra arguments for `sqlalchemy.create_engine`.
+        """
+        db_url = make_url(url)
+        options: Dict[str, Any] = {"insertmanyvalues_page_size": _INSERT_PAGE_SIZE}
+        if db_url.get_backend_name() != "sqlite":
+            options.update(_POOL_OPTIONS)
+        if db_url.get_driver_name() == "psycopg2":
+            options.update(_PSYCOPG2_OPTIONS)
+        options.update(kwargs)
+        return create_engine(db_url, **options)
 
     def create_db(self) -> None:
         """Populate a database with the SQLalchemy-defined schema."""
         Base.metadata.create_all(bind=self.engine)
 
-    def add_component(self, name: str) -> Component:
+    def add_component(self, name: str, commit: bool = True) -> Component:
         """Insert a new component.
 
         Args:
             name: name of the component
+            commit: commit the transaction (otherwise left to the caller)
         """
-        new_comp = Component(name=name)
-        self.session.add(new_comp)
-        self.session.commit()
+        result = self.session.connection().execute(_INSERT_COMPONENT, {"name": name})
+        new_comp = self.session.get_one(Component, result.inserted_primary_key)
+        if commit:
+            self.session.commit()
+        self._components[name] = new_comp
         return new_comp
 
     def get_component(self, name: str, create: bool = False) -> Component:
@@ -74,7 +170,10 @@ class RnaseqRegistry:
         name : Name of the component.
         create : Flag indicating whether to create the component if not found.
         """
-        stmt = select(Component).where(Component.name == name)
+        if name in self._components:
+            return self._components[name]
+
+        stmt = lambda_stmt(lambda: select(Component).where(Component.name == name))
         component = self.session.scalars(stmt).first()
 
         if not component:
@@ -82,6 +181,7 @@ class RnaseqRegistry:
                 component = self.add_component(name)
             else:
                 raise ValueError(f"No component named {name}")
+        self._components[name] = component
         return component
 
     def remove_component(self, name: str) -> None:
@@ -93,29 +193,59 @@ class RnaseqRegistry:
         component = self.get_component(name)
         self.session.delete(component)
         self.session.commit()
+        del self._components[name]
+
+    def _clear_components(self, _session: Session) -> None:
+        """Forget the cached components."""
+        self._components.clear()
 
     def list_components(self) -> List[Component]:
         """List all components."""
+        return list(self.iter_components())
 
-        stmt = select(Component).order_by(Component.name)
-        components = list(self.session.scalars(stmt).all())
-        return components
+    def iter_components(self) -> Iterator[Component]:
+        """Iterate over all components, fetched from the database in batches."""
 
-    def add_organism(self, name: str, component_name: str) -> Organism:
+        stmt = select(Component).order_by(Component.name).execution_options(yield_per=_YIELD_PER)
+        yield from self.session.scalars(stmt)
+
+    def iter_components_counts(self) -> Iterator[Row]:
+        """Iterate over all components with their number of organisms and datasets, from one query.
+
+        Each row has the `name`, `organisms` and `datasets` of a component.
+        """
+        stmt = (
+            select(
+                Component.name,
+                func.count(distinct(Organism.id)).label("organisms"),
+                func.count(Dataset.id).label("datasets"),
+            )
+            .outerjoin(Component.organisms)
+            .outerjoin(Organism.datasets)
+            .group_by(Component.id, Component.name)
+            .order_by(Component.name)
+        )
+        yield from self.session.execute(stmt)
+
+    def add_organism(self, name: str, component_name: str, commit: bool = True) -> Organism:
         """Insert a new organism.
 
         Args:
         name : Name of the organism to add.
         component_name : Name of the component of the organism
+        commit: commit the transaction (otherwise left to the caller)
         """
         try:
             component = self.get_component(component_name)
         except ValueError as err:
             raise ValueError("Cannot add organism for unknown component") from err
 
-        new_org = Organism(abbrev=name, component=component)
-        self.session.add(new_org)
-        self.session.commit()
+        org_row = {"abbrev": name, "component_id": component.id}
+        result = self.session.connection().execute(_INSERT_ORGANISM, org_row)
+        new_org = self.session.get_one(Organism, result.inserted_primary_key)
+        if commit:
+            self.session.commit()
+        self.session.expire(component, ["organisms"])
         return new_org
 
     def get_organism(self, name: str) -> Organism:
@@ -123,7 +253,9 @@ class RnaseqRegistry:
 
         Raises ValueError if the organism can not be found.
         """
-        stmt = select(Organism).options(joinedload(Organism.component)).where(Organism.abbrev == name)
+        stmt = lambda_stmt(
+            lambda: select(Organism).options(joinedload(Organism.component)).where(Organism.abbrev == name)
+        )
 
         organism = self.session.scalars(stmt).first()
 
@@ -140,74 +272,175 @@ class RnaseqRegistry:
         organism = self.get_organism(name)
         self.session.delete(organism)
         self.session.commit()
+        self.session.expire(organism.component, ["organisms"])
 
     def list_organisms(self, component: Optional[str] = None, with_dataset: bool = False) -> List[Organism]:
         """List all organisms.
 
         Args:
         component: filter by component.
+        with_dataset: only keep the organisms that have datasets.
         """
+        return list(self.iter_organisms(component, with_dataset))
+
+    def iter_organisms(
+        self, component: Optional[str] = None, with_dataset: bool = False
+    ) -> Iterator[Organism]:
+        """Iterate over all organisms, fetched from the database in batches.
 
-        stmt = select(Organism).join(Component).order_by(Component.name, Organism.abbrev)
+        Args:
+        component: filter by component.
+        with_dataset: only keep the organisms that have datasets.
+        """
+
+        stmt = (
+            select(Organism)
+            .join(Component)
+            .options(contains_eager(Organism.component))
+            .order_by(Component.name, Organism.abbrev)
+            .execution_options(yield_per=_YIELD_PER)
+        )
+        if component:
+            stmt = stmt.where(Component.name == component)
+        if with_dataset:
+            stmt = stmt.where(Organism.datasets.any()).options(selectinload(Organism.datasets))
+        yield from self.session.scalars(stmt)
+
+    def iter_organisms_counts(
+        self, component: Optional[str] = None, with_dataset: bool = False
+    ) -> Iterator[Row]:
+        """Iterate over all organisms with their number of datasets, from one query.
+
+        Each row has the `component`, `abbrev` and `datasets` of an organism.
+
+        Args:
+        component: filter by component.
+        with_dataset: only keep the organisms that have datasets.
+        """
+        stmt = (
+            select(
+                Component.name.label("component"),
+                Organism.abbrev,
+                func.count(Dataset.id).label("datasets"),
+            )
+            .join(Organism.component)
+            .outerjoin(Organism.datasets)
+            .group_by(Organism.id, Component.name, Organism.abbrev)
+            .order_by(Component.name, Organism.abbrev)
+        )
         if component:
             stmt = stmt.where(Component.name == component)
-        organisms = list(self.session.scalars(stmt).all())
         if with_dataset:
-            organisms = [org for org in organisms if len(org.datasets) > 0]
-        return organisms
+            stmt = stmt.having(func.count(Dataset.id) > 0)
+        yield from self.session.execute(stmt)
 
-    def load_organisms(self, input_file: PathLike) -> int:
+    def load_organisms(self, input_file: PathLike, batch_size: Optional[int] = None) -> int:
         """Import organisms and their components from a file.
 
         Args:
         input_file : Path to the input tab-delimited file.
+        batch_size: Number of rows sent per INSERT execution (default: all at once).
         """
-        # First, get the existing components and abbrevs
-        components = {comp.name: comp for comp in self.list_components()}
-        abbrevs = {org.abbrev for comp in components.values() for org in comp.organisms}
-
-        # Next, get the list of new components and abbrevs, minus the known ones
-        new_orgs_data = []
-        loaded_count = 0
-        with Path(input_file).open("r") as in_data:
-            for line in in_data:
-                line = line.strip()
-                if line == "":
-                    continue
-                parts = line.split("\t")
-                if len(parts) != 2:
-                    raise ValueError(f"Organism line requires 2 values (got {parts})")
-                (component_name, organism_abbrev) = parts
+        _check_batch_size(batch_size)
 
-                # On the fly, create the new components
-                if component_name not in components:
-                    components[component_name] = self.add_component(component_name)
+        # First, get the existing components ids
+        comp_stmt = select(Component.name, Component.id)
+        components: Dict[str, int] = dict(self.session.execute(comp_stmt).all())
 
-                if organism_abbrev in abbrevs:
-                    continue
-                abbrevs.add(organism_abbrev)
+        # Next, get the list of new components and abbrevs (first occurrence of each abbrev)
+        new_orgs_data: Dict[str, str] = {}
+        try:
+            with Path(input_file).open("r", newline="") as in_data:
+                for row in csv.reader(in_data, delimiter="\t", quoting=csv.QUOTE_NONE):
+                    parts = [field.strip() for field in row]
+                    # Like stripping the line: ignore the empty fields from leading or trailing tabs
+                    while parts and not parts[-1]:
+                        parts.pop()
+                    while parts and not parts[0]:
+                        parts.pop(0)
+                    if not parts:
+                        continue
+                    if len(parts) != 2:
+                        raise ValueError(f"Organism line requires 2 values (got {parts})")
+                    (component_name, organism_abbrev) = parts
+
+                    # On the fly, create the new components
+                    if component_name not in components:
+                        components[component_name] = self.add_component(component_name, commit=False).id
+
+                    new_orgs_data.setdefault(organism_abbrev, component_name)
+        except ValueError:
+            # Do not keep the components created before the faulty line
+            self.session.rollback()
+            raise
+
+        # Minus the known abbrevs: only look up the ones from the file, not the whole registry
+        for abbrevs_page in _in_pages(new_orgs_data):
+            for known_abbrev in self.session.scalars(
+                select(Organism.abbrev).where(Organism.abbrev.in_(abbrevs_page))
+            ):
+                del new_orgs_data[known_abbrev]
+
+        # Now that we've created all the components, bulk insert the organisms attached to them
+        # (all in the same transaction)
+        orgs_rows = [
+            {"abbrev": abbrev, "component_id": components[component_name]}
+            for abbrev, component_name in new_orgs_data.items()
+        ]
+        if len(orgs_rows) >= _COPY_THRESHOLD and self._can_copy():
+            self._copy_rows(Organism.__tablename__, orgs_rows)
+        elif orgs_rows:
+            self._insert_rows(insert(Organism), orgs_rows, batch_size)
+        self.session.commit()
+        # The bulk insert bypasses the identity map: refresh the loaded relationships
+        self.session.expire_all()
+        self._analyze(len(orgs_rows))
 
-                new_orgs_data.append({"name": organism_abbrev, "component": component_name})
+        return len(orgs_rows)
 
-        # Now that we've created all the components, add the organisms attached to them
-        orgs_to_add = []
-        for new_org_data in new_orgs_data:
-            org_component = new_org_data["component"]
-            new_org = Organism(abbrev=new_org_data["name"], component=components[org_component])
-            orgs_to_add.append(new_org)
+    def _can_copy(self) -> bool:
+        """Return True if the engine can stream rows with PostgreSQL COPY."""
+        dialect = self.engine.dialect
+        return dialect.name == "postgresql" and dialect.driver == "psycopg2"
 
-            loaded_count += 1
+    def _copy_rows(self, table: str, rows: List[Dict]) -> None:
+        """Stream rows into a table with COPY, within the current session transaction.
 
-        self.session.add_all(orgs_to_add)
-        self.session.commit()
+        Args:
+        table: Name of the table to load.
+        rows: Rows to load, all with the same keys (used as the column names).
+        """
+        columns = tuple(rows[0].keys())
+        buffer = io.StringIO()
+        # CSV format, so that the values with tabs, newlines or backslashes are escaped
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerows([row[column] for column in columns] for row in rows)
+        buffer.seek(0)
+        quote = self.engine.dialect.identifier_preparer.quote_identifier
+        quoted_columns = ", ".join(quote(column) for column in columns)
+        copy_sql = f"COPY {quote(table)} ({quoted_columns}) FROM STDIN WITH (FORMAT csv)"
+        cursor = self.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(copy_sql, buffer)
+        finally:
+            cursor.close()
+
+    def _analyze(self, loaded_count: int) -> None:
+        """Refresh the planner statistics after a large load, so the new rows use the indexes.
 
-        return loaded_count
+        Args:
+        loaded_count: Number of rows that were just loaded.
+        """
+        if loaded_count < _ANALYZE_THRESHOLD or self.engine.dialect.name not in ("sqlite", "postgresql"):
+            return
+        self.session.execute(text("ANALYZE"))
+        self.session.commit()
 
     def _check_json_data(
         self,
         json_data: List[Dict],
-        cur_datasets: Dict[str, Dict],
-        abbrevs: Dict[str, Organism],
+        cur_datasets: Dict[Tuple[str, str], Row],
+        abbrevs: Dict[str, int],
         release: Optional[int] = None,
         replace: bool = False,
     ) -> List[Dict]:
@@ -215,38 +448,52 @@ class RnaseqRegistry:
 
         If the organism does't exist, add it if `replace` is set, otherwise skip that dataset.
         If the dataset already exists, retire if `replace` is set, otherwise skip that dataset.
+        Nothing is committed: the new organisms and retired datasets are left to the caller's transaction.
+        The current datasets are given as rows (with their id and release), by (abbrev, name).
         """
         checked_json_data = []
+        retired_ids = []
         for dataset in json_data:
             component = dataset["component"]
             organism_name = dataset["species"]
             if not organism_name in abbrevs:
                 if replace:
-                    print(f"ADD organism '{organism_name}' not in the registry")
-                    org = self.add_organism(organism_name, component)
-                    abbrevs[organism_name] = org
+                    logging.info("ADD organism '%s' not in the registry", organism_name)
+                    org = self.add_organism(organism_name, component, commit=False)
+                    abbrevs[organism_name] = org.id
                 else:
-                    print(f"SKIP organism '{organism_name}' not in the registry")
+                    logging.warning("SKIP organism '%s' not in the registry", organism_name)
+                    continue
+            cur_dataset = cur_datasets.get((organism_name, dataset["name"]))
+            if cur_dataset is not None:
+                if replace:
+                    logging.info(
+                        "Retire dataset %s/%s from %s", organism_name, dataset["name"], cur_dataset.release
+                    )
+                    retired_ids.append(cur_dataset.id)
+                else:
+                    logging.warning(
+                        "SKIP dataset %s/%s already in %s",
+                        organism_name,
+                        dataset["name"],
+                        cur_dataset.release,
+                    )
                     continue
-            try:
-                cur_dataset: Dataset = cur_datasets[organism_name][dataset["name"]]
-                if cur_dataset is not None:
-                    if replace:
-                        print(f"Retire dataset {organism_name}/{dataset['name']} from {cur_dataset.release}")
-                        self.retire_dataset(cur_dataset, release)
-                    else:
-                        print(
-                            f"SKIP dataset {organism_name}/{dataset['name']} already in {cur_dataset.release}"
-                        )
-                        continue
-            except KeyError:
-                pass
             checked_json_data.append(dataset)
 
+        # Retire all the replaced datasets at once
+        if retired_ids:
+            self._retire_datasets(retired_ids, release)
+
         return checked_json_data
 
     def load_datasets(
-        self, input_file: PathLike, release: int = 0, replace: bool = False, ignore: bool = False
+        self,
+        input_file: PathLike,
+        release: int = 0,
+        replace: bool = False,
+        ignore: bool = False,
+        batch_size: Optional[int] = None,
     ) -> int:
         """Import datasets from a json file.
 
@@ -255,24 +502,32 @@ class RnaseqRegistry:
         release: Release number for that dataset.
         replace: Replace a dataset.
         ignore: Ignore the loaded datasets.
+        batch_size: Number of rows sent per INSERT execution (default: all at once).
         """
+        _check_batch_size(batch_size)
+
         # Validate the json file
-        json_schema_file = _RNASEQ_SCHEMA_PATH
         with open(input_file) as input_fh:
             json_data = json.load(input_fh)
-        with open(json_schema_file) as schema_fh:
-            schema = json.load(schema_fh)
-        validate(instance=json_data, schema=schema)
+        _RNASEQ_VALIDATOR.validate(json_data)
 
-        # Get the existing abbrevs
-        abbrevs = {org.abbrev: org for org in self.list_organisms()}
-        new_datasets_list: List = []
-        loaded_count = 0
+        # Get the ids of the existing organisms used in the file
+        wanted_abbrevs = {dataset["species"] for dataset in json_data}
+        abbrevs: Dict[str, int] = {}
+        for abbrevs_page in _in_pages(wanted_abbrevs):
+            org_stmt = select(Organism.abbrev, Organism.id).where(Organism.abbrev.in_(abbrevs_page))
+            abbrevs.update(self.session.execute(org_stmt).all())
 
         # Get the existing datasets
-        cur_datasets: Dict[str, Dict] = {abb: {} for abb in abbrevs}
-        for cur_dataset_tmp in self.list_datasets():
-            cur_datasets[cur_dataset_tmp.organism.abbrev][cur_dataset_tmp.name] = cur_dataset_tmp
+        cur_datasets: Dict[Tuple[str, str], Row] = {}
+        for abbrevs_page in _in_pages(abbrevs):
+            cur_stmt = (
+                select(Organism.abbrev, Dataset.name, Dataset.id, Dataset.release)
+                .join(Dataset.organism)
+                .where(Dataset.latest, Organism.abbrev.in_(abbrevs_page))
+            )
+            for cur_dataset in self.session.execute(cur_stmt):
+                cur_datasets[(cur_dataset.abbrev, cur_dataset.name)] = cur_dataset
 
         # First run to check if the datasets are already loaded
         checked_json_data = self._check_json_data(
@@ -282,42 +537,137 @@ class RnaseqRegistry:
         if diff_data > 0:
             if not ignore:
                 print(f"{diff_data}/{len(json_data)} datasets can not be loaded (use --replace or --ignore)")
+                self.session.rollback()
                 return 0
 
-        # Second run to actually add things
+        # Second run to actually add things, with one bulk insert per table (parents first)
+        dataset_rows = []
         for dataset in checked_json_data:
-            organism_name = dataset["species"]
-            samples = []
-            for run in dataset["runs"]:
-                accessions = [Accession(sra_id=acc) for acc in run["accessions"]]
-                trim_reads = run.get("trim_reads", False)
-                samples.append(Sample(name=run["name"], accessions=accessions, trim_reads=trim_reads))
-
             # Replace release (higher priority from file)
             if "release" in dataset:
                 release = dataset["release"]
-            no_spliced = dataset.get("no_spliced", False)
-
-            organism = abbrevs[organism_name]
-            new_dataset = Dataset(
-                name=dataset["name"],
-                organism_id=organism.id,
-                samples=samples,
-                release=release,
-                no_spliced=no_spliced,
+            dataset_rows.append(
+                {
+                    "name": dataset["name"],
+                    "organism_id": abbrevs[dataset["species"]],
+                    "release": release,
+                    "no_spliced": dataset.get("no_spliced", False),
+                }
             )
-            new_datasets_list.append(new_dataset)
-            loaded_count += 1
-
-        self.session.add_all(new_datasets_list)
+        if not dataset_rows:
+            return 0
+        datasets_runs = [dataset["runs"] for dataset in checked_json_data]
+        # The retirements, new organisms and datasets are committed together, or not at all
+        try:
+            self._insert_datasets(dataset_rows, datasets_runs, batch_size)
+        except Exception:
+            self.session.rollback()
+            raise
         self.session.commit()
+        # The bulk insert bypasses the identity map: refresh the loaded relationships
+        self.session.expire_all()
+        self._analyze(len(dataset_rows))
 
-        return loaded_count
+        return len(dataset_rows)
+
+    def _insert_datasets(
+        self,
+        dataset_rows: List[Dict],
+        datasets_runs: List[List[Dict]],
+        batch_size: Optional[int] = None,
+    ) -> None:
+        """Bulk insert datasets with their samples and accessions, one insert per table (parents first).
+
+        Args:
+        dataset_rows: Column values of each dataset to insert.
+        datasets_runs: Runs of each dataset, in the json format (name, accessions, trim_reads).
+        batch_size: Number of rows sent per INSERT execution (default: all at once).
+        """
+        dataset_ids = self._insert_rows(
+            insert(Dataset).returning(Dataset.id, sort_by_parameter_order=True), dataset_rows, batch_size
+        )
+
+        sample_rows = []
+        samples_accessions = []
+        for dataset_id, runs in zip(dataset_ids, datasets_runs):
+            for run in runs:
+                sample_rows.append(
+                    {
+                        "name": run["name"],
+                        "dataset_id": dataset_id,
+                        "trim_reads": run.get("trim_reads", False),
+                    }
+                )
+                samples_accessions.append(run["accessions"])
+        if not sample_rows:
+            return
+        sample_ids = self._insert_rows(
+            insert(Sample).returning(Sample.id, sort_by_parameter_order=True), sample_rows, batch_size
+        )
+
+        accession_rows = [
+            {"sra_id": accession, "sample_id": sample_id}
+            for sample_id, accessions in zip(sample_ids, samples_accessions)
+            for accession in accessions
+        ]
+        if accession_rows:
+            self._insert_rows(insert(Accession), accession_rows, batch_size)
+
+    def _insert_rows(self, stmt: Insert, rows: List[Dict], batch_size: Optional[int] = None) -> List[Any]:
+        """Execute a bulk insert in batches of `batch_size` rows, within the current session transaction.
+
+        Args:
+        stmt: Insert statement, with or without RETURNING.
+        rows: Column values of each row to insert.
+        batch_size: Number of rows sent per INSERT execution (default: all at once).
+
+        Returns:
+        The returned values of each row, in the order of the rows (if the statement has a RETURNING clause).
+        """
+        options: Dict[str, Any] = {}
+        if batch_size is None:
+            batch_size = max(len(rows), 1)
+        else:
+            options["insertmanyvalues_page_size"] = batch_size
+        returned: List[Any] = []
+        for start in range(0, len(rows), batch_size):
+            result = self.session.execute(stmt, rows[start : start + batch_size], execution_options=options)
+            if stmt.exported_columns:
+                returned.extend(result.scalars())
+        return returned
+
+    def _retire_datasets(self, dataset_ids: List[int], release: Optional[int] = None) -> None:
+        """Retire datasets with bulk UPDATEs, within the current session transaction.
+
+        Args:
+        dataset_ids: Ids of the datasets to retire.
+        release: Release the datasets are retired from.
+        """
+        for ids_page in _in_pages(dataset_ids):
+            retire_stmt = update(Dataset).where(Dataset.id.in_(ids_page)).values(latest=False)
+            if release is not None:
+                retire_stmt = retire_stmt.values(retired=release)
+            self.session.execute(retire_stmt)
 
     def remove_dataset(self, dataset: Dataset) -> None:
         """Delete a dataset."""
-        self.session.delete(dataset)
+        self.remove_datasets([dataset])
+
+    def remove_datasets(self, datasets: List[Dataset]) -> None:
+        """Delete datasets with their samples and accessions, with bulk deletes (children first).
+
+        Args:
+        datasets: List of datasets to delete.
+        """
+        for ids_page in _in_pages(dataset.id for dataset in datasets):
+            samples_page = select(Sample.id).where(Sample.dataset_id.in_(ids_page))
+            self.session.execute(delete(Accession).where(Accession.sample_id.in_(samples_page)))
+            self.session.execute(delete(Sample).where(Sample.dataset_id.in_(ids_page)))
+            self.session.execute(delete(Dataset).where(Dataset.id.in_(ids_page)))
         self.session.commit()
+        for dataset in datasets:
+            if dataset.organism is not None:
+                self.session.expire(dataset.organism, ["datasets"])
 
     def retire_dataset(self, dataset: Dataset, release: Optional[int] = 0) -> None:
         """Delete a dataset."""
@@ -335,20 +685,28 @@ class RnaseqRegistry:
         latest: Optional[bool] = True,
     ) -> List[Dataset]:
         """Get all datasets with the provided filters."""
+        return list(self.iter_datasets(component, organism, dataset_name, release, latest))
+
+    def iter_datasets(
+        self,
+        component: Optional[str] = None,
+        organism: Optional[str] = None,
+        dataset_name: Optional[str] = None,
+        release: Optional[int] = None,
+        latest: Optional[bool] = True,
+    ) -> Iterator[Dataset]:
+        """Iterate over the datasets with the provided filters, fetched from the database in batches."""
 
         stmt = (
             select(Dataset)
             .join(Organism)
             .join(Component)
-            .join(Sample)
-            .join(Accession)
             .options(
-                joinedload(Dataset.samples),
-                joinedload(Dataset.organism),
-            )
-            .order_by(
-                Dataset.release, Component.name, Organism.abbrev, Dataset.name, Sample.name, Accession.sra_id
+                selectinload(Dataset.samples).selectinload(Sample.accessions),
+                contains_eager(Dataset.organism).contains_eager(Organism.component),
             )
+            .order_by(Dataset.release, Component.name, Organism.abbrev, Dataset.name)
+            .execution_options(yield_per=_YIELD_PER)
         )
         if component:
             stmt = stmt.where(Component.name == component)
@@ -361,8 +719,7 @@ class RnaseqRegistry:
         if latest is not None:
             stmt = stmt.where(Dataset.latest == latest)
 
-        datasets = self.session.scalars(stmt).unique()
-        return list(datasets)
+        yield from self.session.scalars(stmt)
 
     def remap(
         self, org_from: str, org_to: str, release: int = 0, retire_remapped: Optional[bool] = False
@@ -376,34 +733,47 @@ class RnaseqRegistry:
 
         new_org = self.get_organism(org_to)
         # Deep copy each dataset - samples - accessions
-        new_datasets = []
+        new_dataset_rows = []
+        new_datasets_runs = []
         for old_dataset in datasets_from:
-            new_samples = []
-            for old_sample in old_dataset.samples:
-                new_accessions = [Accession(sra_id=acc.sra_id) for acc in old_sample.accessions]
-                new_samples.append(Sample(name=old_sample.name, accessions=new_accessions))
-            new_datasets.append(
-                Dataset(name=old_dataset.name, organism_id=new_org.id, samples=new_samples, release=release)
+            new_dataset_rows.append({"name": old_dataset.name, "organism_id": new_org.id, "release": release})
+            new_datasets_runs.append(
+                [
+                    {"name": old_sample.name, "accessions": [acc.sra_id for acc in old_sample.accessions]}
+                    for old_sample in old_dataset.samples
+                ]
             )
-        if retire_remapped:
-            for old_dataset in datasets_from:
-                logging.info(f"Retire dataset {org_from}/{old_dataset.name} from {old_dataset.release}")
-                self.retire_dataset(old_dataset, release)
-
-        self.session.add_all(new_datasets)
+        # Same transaction as the copies: the old datasets are only retired if the remap succeeds
+        try:
+            if retire_remapped:
+                for old_dataset in datasets_from:
+                    logging.info(f"Retire dataset {org_from}/{old_dataset.name} from {old_dataset.release}")
+                self._retire_datasets([old_dataset.id for old_dataset in datasets_from], release)
+            self._insert_datasets(new_dataset_rows, new_datasets_runs)
+        except Exception:
+            self.session.rollback()
+            raise
         self.session.commit()
+        # The bulk insert bypasses the identity map: refresh the loaded relationships
+        self.session.expire_all()
 
-    def dump_datasets(self, dump_path: Path, datasets: List[Dataset]) -> None:
-        """Print the datasets to a file.
+    def dump_datasets(self, dump_path: Path, datasets: Iterable[Dataset]) -> None:
+        """Print the datasets to a file, as a json list written one dataset at a time.
 
         Args:
         dump_path: Path to a file to dump the data.
-        datasets: List of datasets to dump.
+        datasets: Datasets to dump (e.g. a list, or streamed from `iter_datasets`).
 
         """
-        json_data = [dataset.to_json_struct() for dataset in datasets]
-        with dump_path.open("w") as out_json:
-            out_json.write(json.dumps(json_data, indent=2, sort_keys=True))
+        separator = "\n  "
+        with dump_path.open("w", buffering=_WRITE_BUFFER_SIZE) as out_json:
+            out_json.write("[")
+            for dataset in datasets:
+                # Same layout as encoding the whole list: each dataset indented one level
+                dataset_json = _JSON_ENCODER.encode(dataset.to_json_struct())
+                out_json.write(separator + dataset_json.replace("\n", "\n  "))
+                separator = ",\n  "
+            out_json.write("]" if separator == "\n  " else "\n]")
 
     def dump_datasets_folder(self, dump_path: Path, datasets: List[Dataset]) -> None:
         """Print the datasets to files in a folder structure: build_xx/component/orgAbbrev_dataset_name.json
@@ -413,9 +783,16 @@ class RnaseqRegistry:
         datasets: List of datasets to dump.
 
         """
+        # Serialize first (the ORM objects are only used from this thread)
+        files_content: Dict[Path, str] = {}
         for dataset in datasets:
             folder_path: Path = dump_path / f"build_{dataset.release}" / dataset.organism.component.name
-            folder_path.mkdir(parents=True, exist_ok=True)
             file_path = folder_path / f"{dataset.organism.abbrev}_{dataset.name}.json"
-            with file_path.open("w") as out_json:
-                out_json.write(json.dumps(dataset.to_json_struct(), indent=2, sort_keys=True))
+            files_content[file_path] = _JSON_ENCODER.encode(dataset.to_json_struct())
+
+        for folder_path in {file_path.parent for file_path in files_content}:
+            folder_path.mkdir(parents=True, exist_ok=True)
+
+        # Then write all the files in parallel
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(lambda item: item[0].write_text(item[1]), files_content.items()))
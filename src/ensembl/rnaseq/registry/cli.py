@@ -21,32 +21,97 @@ Can be imported as a module and called as a script as well, with the same parame
 import logging
 from os import PathLike
 from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 import argparse
-from sqlalchemy import create_engine
 
-from ensembl.rnaseq.registry.api import RnaseqRegistry
+if TYPE_CHECKING:
+    from sqlalchemy import Engine
 
+# SQLAlchemy and the registry API are only imported by the subcommands that use them, so that
+# the parsing of the arguments (and --help) does not pay for their import.
+# pylint: disable=import-outside-toplevel
 
-def get_engine(dbfile: PathLike):
-    """Returns an SQLalchemy engine.
+_SQLITE_PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+
+def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+    """Tune every new SQLite connection for bulk loads (and no fsync on each commit in WAL mode)."""
+    cursor = dbapi_connection.cursor()
+    for pragma in _SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    # Only safe from corruption with a WAL journal (see `create --wal`)
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+_DATABASE_HELP = "SQLite3 RNA-Seq registry database"
+
+# Engines already created in this process, by database file, with the inode of the file they use
+_ENGINES: Dict[Path, Tuple[Optional[int], "Engine"]] = {}
+
+
+def _inode(db_path: Path) -> Optional[int]:
+    """Returns the inode of a file, or None if it does not exist."""
+    try:
+        return db_path.stat().st_ino
+    except FileNotFoundError:
+        return None
+
+
+def get_engine(dbfile: PathLike) -> "Engine":
+    """Returns an SQLalchemy engine, reused for the same file within a process.
+
+    The engine is replaced if the file was deleted or replaced since it was created (its pooled
+    connections would still use the old file).
 
     Args:
         dbfile (PathLike): Path to the SQLite file to use as registry.
     """
-    db_url = f"sqlite:///{dbfile}"
-    return create_engine(db_url)
+    from sqlalchemy import create_engine, event
+
+    db_path = Path(dbfile).resolve()
+    inode = _inode(db_path)
+    if db_path in _ENGINES:
+        cached_inode, engine = _ENGINES[db_path]
+        if cached_inode is None or cached_inode == inode:
+            # The file may have been created through this engine since it was cached
+            _ENGINES[db_path] = (inode, engine)
+            return engine
+        _drop_engine(db_path)
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    _ENGINES[db_path] = (inode, engine)
+    return engine
+
+
+def _drop_engine(dbfile: PathLike) -> None:
+    """Close the connections of the cached engine for a database file, if any."""
+    cached = _ENGINES.pop(Path(dbfile).resolve(), None)
+    if cached is not None:
+        cached[1].dispose()
 
 
 def create_db(args):
     """Actions for the subcommand "create"."""
+    from ensembl.rnaseq.registry.api import RnaseqRegistry
+
     db = args.database
 
     if Path(db).is_file():
         if not args.force:
             print(f"Database already exists: {db}")
             return
+        _drop_engine(db)
         Path(db).unlink()
+        # Leftovers of a WAL journal would be applied to the new database
+        for suffix in ("-wal", "-shm"):
+            Path(f"{db}{suffix}").unlink(missing_ok=True)
         print(f"Recreate the database {db} from scratch")
     else:
         print(f"Create the new database {db}")
@@ -54,129 +119,153 @@ def create_db(args):
     engine = get_engine(args.database)
     # SQLAlchemy create_db here
 
-    reg = RnaseqRegistry(engine)
-    reg.create_db()
+    with RnaseqRegistry(engine) as reg:
+        reg.create_db()
+
+    if args.wal:
+        # The journal mode is stored in the database file: all the later connections use it
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
 
 
 def change_component(args):
     """Actions for the subcommand "component"."""
-    engine = get_engine(args.database)
-    reg = RnaseqRegistry(engine)
+    from ensembl.rnaseq.registry.api import RnaseqRegistry
 
-    if args.add:
-        reg.add_component(args.add)
+    engine = get_engine(args.database)
+    with RnaseqRegistry(engine) as reg:
+        if args.add:
+            reg.add_component(args.add)
 
-    elif args.get:
-        component = reg.get_component(args.get)
-        print(component)
+        elif args.get:
+            component = reg.get_component(args.get)
+            print(component)
 
-    elif args.remove:
-        reg.remove_component(args.remove)
+        elif args.remove:
+            reg.remove_component(args.remove)
 
-    elif args.list:
-        components = reg.list_components()
-        for component in components:
-            print(component)
+        elif args.list:
+            # Same output as printing each component, without loading their organisms and datasets
+            for counts in reg.iter_components_counts():
+                print(f"{counts.name}\t({counts.organisms} organisms)\t({counts.datasets} datasets)")
 
 
 def change_organism(args):
     """Actions for the subcommand "organism"."""
-    engine = get_engine(args.database)
-    reg = RnaseqRegistry(engine)
+    from ensembl.rnaseq.registry.api import RnaseqRegistry
 
-    if args.add:
-        if not args.component:
-            print("Need a component for the organism")
-            raise ValueError("Need a component")
-        reg.add_organism(args.add, args.component)
-
-    elif args.get:
-        organism = reg.get_organism(args.get)
-        print(organism)
+    engine = get_engine(args.database)
+    with RnaseqRegistry(engine) as reg:
+        if args.add:
+            if not args.component:
+                print("Need a component for the organism")
+                raise ValueError("Need a component")
+            reg.add_organism(args.add, args.component)
+
+        elif args.get:
+            organism = reg.get_organism(args.get)
+            print(organism)
 
-    elif args.remove:
-        reg.remove_organism(args.remove)
+        elif args.remove:
+            reg.remove_organism(args.remove)
 
-    elif args.list:
-        organisms = reg.list_organisms(args.component, args.with_datasets)
-        for organism in organisms:
-            print(organism)
+        elif args.list:
+            # Same output as printing each organism, without loading their datasets
+            for counts in reg.iter_organisms_counts(args.component, args.with_datasets):
+                print(f"{counts.component}\t{counts.abbrev}\t({counts.datasets} datasets)")
 
-    elif args.load:
-        loaded_count = reg.load_organisms(args.load)
-        print(f"Loaded {loaded_count} organisms")
+        elif args.load:
+            loaded_count = reg.load_organisms(args.load, batch_size=args.batch_size)
+            print(f"Loaded {loaded_count} organisms")
 
 
 def change_dataset(args):
     """Actions for the subcommand "dataset"."""
-    engine = get_engine(args.database)
-    reg = RnaseqRegistry(engine)
-
-    if args.load:
-        loaded_count = reg.load_datasets(
-            args.load, release=args.release, replace=args.replace, ignore=args.ignore
-        )
-        print(f"Loaded {loaded_count} datasets")
-
-    elif args.remap:
-        orgs = str(args.remap).split(",")
-        if len(orgs) != 2:
-            logging.warning("Remap requires 2 organism abbrevs separated by a comma")
-            return
-        reg.remap(orgs[0].strip(), orgs[1].strip(), args.release, args.retire_remapped)
-
-    else:
-        latest = True
-        if args.not_latest:
-            latest = False
-        datasets = reg.list_datasets(
-            component=args.component,
-            organism=args.organism,
-            dataset_name=args.dataset,
-            release=args.release,
-            latest=latest,
-        )
+    from ensembl.rnaseq.registry.api import RnaseqRegistry
 
-        if args.list:
-            # print(f"{len(datasets)} datasets selected")
-            for dataset in datasets:
-                print(dataset)
-
-        if args.remove:
-            for dataset in datasets:
-                reg.remove_dataset(dataset)
-
-        if args.retire:
-            for dataset in datasets:
-                reg.retire_dataset(dataset, args.retire)
-
-        if args.dump_file:
-            reg.dump_datasets(Path(args.dump_file), datasets)
-
-        if args.dump_folder:
-            reg.dump_datasets_folder(Path(args.dump_folder), datasets)
+    engine = get_engine(args.database)
+    with RnaseqRegistry(engine) as reg:
+        if args.load:
+            loaded_count = reg.load_datasets(
+                args.load,
+                release=args.release,
+                replace=args.replace,
+                ignore=args.ignore,
+                batch_size=args.batch_size,
+            )
+            print(f"Loaded {loaded_count} datasets")
+
+        elif args.remap:
+            orgs = str(args.remap).split(",")
+            if len(orgs) != 2:
+                logging.warning("Remap requires 2 organism abbrevs separated by a comma")
+                return
+            reg.remap(orgs[0].strip(), orgs[1].strip(), args.release, args.retire_remapped)
+
+        else:
+            latest = True
+            if args.not_latest:
+                latest = False
+            datasets = reg.list_datasets(
+                component=args.component,
+                organism=args.organism,
+                dataset_name=args.dataset,
+                release=args.release,
+                latest=latest,
+            )
+
+            if args.list:
+                # print(f"{len(datasets)} datasets selected")
+                for dataset in datasets:
+                    print(dataset)
+
+            if args.remove:
+                reg.remove_datasets(datasets)
+
+            if args.retire:
+                for dataset in datasets:
+                    reg.retire_dataset(dataset, args.retire)
+
+            if args.dump_file:
+                reg.dump_datasets(Path(args.dump_file), datasets)
+
+            if args.dump_folder:
+                reg.dump_datasets_folder(Path(args.dump_folder), datasets)
 
 
 def do_nothing(_) -> None:
     """If no subparser argument, do nothing"""
 
 
-def main() -> None:
-    """Main script entry-point."""
+def run_cli(argv: Optional[List[str]] = None) -> None:
+    """Run one command line, e.g. `run_cli(["component", "registry.db", "--list"])`.
+
+    The engines are kept between calls, so a script running many commands on the same registry
+    only creates one.
+
+    Args:
+        argv: Command line arguments (default: `sys.argv[1:]`).
+    """
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(help="Subcommands")
     parser.set_defaults(func=do_nothing)
+    parser.add_argument("--verbose", action="store_true", help="Show the details of each loaded dataset")
 
     # Create submenu
     create_parser = subparsers.add_parser("create")
     create_parser.set_defaults(func=create_db)
-    create_parser.add_argument("database", help="SQLite3 RNA-Seq registry database")
+    create_parser.add_argument("database", help=_DATABASE_HELP)
     create_parser.add_argument("--force", action="store_true", help="Replace if the db already exists")
+    create_parser.add_argument(
+        "--wal",
+        action="store_true",
+        help="Use a write-ahead log journal (faster writes, kept by the db file, not on network filesystems)",
+    )
 
     # Component submenu
     component_parser = subparsers.add_parser("component")
     component_parser.set_defaults(func=change_component)
-    component_parser.add_argument("database", help="SQLite3 RNA-Seq registry database")
+    component_parser.add_argument("database", help=_DATABASE_HELP)
     component_parser.add_argument("--add", help="Name of a component to add")
     component_parser.add_argument("--remove", help="Name of a component to remove")
     component_parser.add_argument("--get", help="Name of a component to show")
@@ -185,7 +274,7 @@ def main() -> None:
     # Organism submenu
     organism_parser = subparsers.add_parser("organism")
     organism_parser.set_defaults(func=change_organism)
-    organism_parser.add_argument("database", help="SQLite3 RNA-Seq registry database")
+    organism_parser.add_argument("database", help=_DATABASE_HELP)
     organism_parser.add_argument("--component", help="Name of a component")
     organism_parser.add_argument("--add", help="Name of a organism to add")
     organism_parser.add_argument("--remove", help="Name of a organism to remove")
@@ -197,12 +286,14 @@ def main() -> None:
     organism_parser.add_argument(
         "--load", help="Load organism abbrevs and components from a tab file (component\torganism_abbrev)"
     )
+    organism_parser.add_argument("--batch-size", type=int, help="Number of rows per INSERT when loading")
 
     # Dataset submenu
     dataset_parser = subparsers.add_parser("dataset")
     dataset_parser.set_defaults(func=change_dataset)
-    dataset_parser.add_argument("database", help="SQLite3 RNA-Seq registry database")
+    dataset_parser.add_argument("database", help=_DATABASE_HELP)
     dataset_parser.add_argument("--load", help="Dataset data to load in json format")
+    dataset_parser.add_argument("--batch-size", type=int, help="Number of rows per INSERT when loading")
     dataset_parser.add_argument("--component", help="Filter with a component")
     dataset_parser.add_argument("--organism", help="Filter with an organism")
     dataset_parser.add_argument("--dataset", help="Filter with a dataset name")
@@ -234,10 +325,18 @@ def main() -> None:
     )
 
     # Parse args and start the submenu action
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    # basicConfig only configures the root logger once per process: set the level of each run separately
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
 
     args.func(args)
 
 
+def main() -> None:
+    """Main script entry-point."""
+    run_cli()
+
+
 if __name__ == "__main__":
     main()
@@ -53,7 +53,7 @@ class Organism(Base):
     __tablename__ = "organism"
     id: Mapped[int] = mapped_column(primary_key=True)
     abbrev: Mapped[str] = mapped_column(String, unique=True)
-    component_id: Mapped[int] = mapped_column(ForeignKey("component.id"))
+    component_id: Mapped[int] = mapped_column(ForeignKey("component.id"), index=True)
     component: Mapped["Component"] = relationship(back_populates="organisms")
     datasets: Mapped[List["Dataset"]] = relationship(back_populates="organism")
 
@@ -73,17 +73,19 @@ class Dataset(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String)
-    release: Mapped[int] = mapped_column(Integer, default=0)
+    release: Mapped[int] = mapped_column(Integer, default=0, index=True)
     retired: Mapped[int] = mapped_column(Integer, default=0)
     latest: Mapped[bool] = mapped_column(Boolean, default=True)
     no_spliced: Mapped[bool] = mapped_column(Boolean, default=False)
 
-    organism_id: Mapped[int] = mapped_column(ForeignKey("organism.id"))
+    organism_id: Mapped[int] = mapped_column(ForeignKey("organism.id"), index=True)
     organism: Mapped["Organism"] = relationship(back_populates="datasets")
     UniqueConstraint(name, organism_id, latest, retired)
 
     # Relationships
-    samples: Mapped[List["Sample"]] = relationship(back_populates="dataset", cascade="all")
+    samples: Mapped[List["Sample"]] = relationship(
+        back_populates="dataset", cascade="all", order_by="Sample.name"
+    )
 
     def __repr__(self) -> str:
         return (
@@ -128,12 +130,14 @@ class Sample(Base):
     __tablename__ = "sample"
     id: Mapped[int] = mapped_column(primary_key=True)
     name: Mapped[str] = mapped_column(String)
-    dataset_id: Mapped[int] = mapped_column(ForeignKey("dataset.id"))
+    dataset_id: Mapped[int] = mapped_column(ForeignKey("dataset.id"), index=True)
     trim_reads: Mapped[bool] = mapped_column(Boolean, default=False)
 
     # Relationships
     dataset: Mapped["Dataset"] = relationship(back_populates="samples")
-    accessions: Mapped[List["Accession"]] = relationship(back_populates="sample", cascade="all")
+    accessions: Mapped[List["Accession"]] = relationship(
+        back_populates="sample", cascade="all", order_by="Accession.id"
+    )
 
     def __repr__(self) -> str:
         return f"sample(accessions={self.accessions!r}, dataset={self.dataset!r})"
@@ -145,7 +149,7 @@ class Accession(Base):
     __tablename__ = "accession"
     id: Mapped[int] = mapped_column(primary_key=True)
     sra_id: Mapped[str] = mapped_column(String)
-    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id"))
+    sample_id: Mapped[int] = mapped_column(ForeignKey("sample.id"), index=True)
 
     # Relationships
     sample: Mapped[Sample] = relationship(back_populates="accessions", cascade="all")
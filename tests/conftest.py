@@ -40,6 +40,9 @@ def assert_files() -> Callable[[Path, Path], None]:
     """Provide a function that asserts two files and show a diff if they differ."""
 
     def _assert_files(result_path: Path, expected_path: Path) -> None:
+        # Identical files need no diff
+        if result_path.read_bytes() == expected_path.read_bytes():
+            return
         with open(result_path, "r") as result_fh:
             results = result_fh.readlines()
         with open(expected_path, "r") as expected_fh:
@@ -15,23 +15,43 @@
 """
 Unit tests for the RNA-Seq registry API.
 """
+from collections import Counter
 from contextlib import nullcontext as does_not_raise
+import json
 from pathlib import Path
-from typing import Callable, ContextManager, Optional
+from typing import Callable, ContextManager, Iterator, Optional
 
+from jsonschema import ValidationError
 import pytest
 from pytest import raises
-from sqlalchemy import inspect as sql_inspect, create_engine
+from sqlalchemy import event, func, inspect as sql_inspect, create_engine, select
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
 
+from ensembl.rnaseq.registry import api
 from ensembl.rnaseq.registry.api import RnaseqRegistry
+from ensembl.rnaseq.registry.database_schema import Accession, Sample
 
 
 _CUR_DIR = Path(__file__).parent
 
 
-class Test_RNASeqRegistry:
+@pytest.fixture(scope="module", name="several_datasets_reg")
+def fixture_several_datasets_reg(data_dir: Path) -> Iterator[RnaseqRegistry]:
+    """Registry loaded once with the datasets from datasets_several.json (release 10).
+
+    Shared by all the tests of the module: only use it for read-only tests.
+    """
+    engine = create_engine("sqlite:///:memory:")
+    with RnaseqRegistry(engine) as reg:
+        reg.create_db()
+        reg.load_organisms(data_dir / "shared_orgs_file.tab")
+        reg.load_datasets(data_dir / "datasets_several.json", release=10)
+        yield reg
+    engine.dispose()
+
+
+class Test_RNASeqRegistry:  # pylint: disable=too-many-public-methods
     """Tests for the RNASeqRegistry module."""
 
     @pytest.fixture
@@ -56,19 +76,33 @@ class Test_RNASeqRegistry:
         reg = RnaseqRegistry(engine)
         assert isinstance(reg, RnaseqRegistry)
 
+    def test_create_engine(self) -> None:
+        """Check the registry can create its own engine."""
+        engine = RnaseqRegistry.create_engine("sqlite:///:memory:")
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        assert not reg.list_components()
+
+    def test_context_manager(self, engine: Engine) -> None:
+        """Check the registry session is closed on exit, without the uncommitted changes."""
+        with RnaseqRegistry(engine) as reg:
+            reg.create_db()
+            reg.add_component("TestDB")
+            reg.add_component("UncommittedDB", commit=False)
+
+        other_reg = RnaseqRegistry(engine)
+        assert [comp.name for comp in other_reg.list_components()] == ["TestDB"]
+
     def test_create_tables(self, engine: Engine) -> None:
         """Test creating tables from scratch."""
 
         reg = RnaseqRegistry(engine)
+        assert not sql_inspect(reg.engine).get_table_names()
         reg.create_db()
 
         # Check if the tables are created in the test database file
-        insp = sql_inspect(reg.engine)
-        assert insp.has_table("component")
-        assert insp.has_table("organism")
-        assert insp.has_table("dataset")
-        assert insp.has_table("sample")
-        assert insp.has_table("accession")
+        table_names = set(sql_inspect(reg.engine).get_table_names())
+        assert {"component", "organism", "dataset", "sample", "accession"} <= table_names
 
     @pytest.mark.dependency(name="add_get_feature")
     @pytest.mark.parametrize(
@@ -109,6 +143,8 @@ class Test_RNASeqRegistry:
         reg.add_component(added_component)
         with expectation:
             reg.remove_component(removed_component)
+            with raises(ValueError):
+                reg.get_component(removed_component)
 
     @pytest.mark.dependency(depends=["add_get_feature"])
     @pytest.mark.parametrize(
@@ -174,6 +210,9 @@ class Test_RNASeqRegistry:
         "organism_file, component, organism, expectation",
         [
             pytest.param("organisms_ok.tab", "TestDB", "SpeciesA", does_not_raise(), id="Import organisms"),
+            pytest.param(
+                "organisms_edge_tabs.tab", "TestDB", "SpeciesA", does_not_raise(), id="Leading/trailing tabs"
+            ),
         ],
     )
     def test_load_organisms(
@@ -211,6 +250,85 @@ class Test_RNASeqRegistry:
         assert num_components == num_components_after
         assert num_organisms == num_organisms_after
 
+    @pytest.mark.dependency(depends=["add_get_feature"])
+    def test_load_organisms_invalid(self, data_dir: Path, engine: Engine) -> None:
+        """Test that a faulty organisms file does not leave any new component behind."""
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        with raises(ValueError):
+            reg.load_organisms(data_dir / "organisms_invalid.tab")
+
+        assert not reg.list_components()
+        with raises(ValueError, match="No component named TestDB3"):
+            reg.get_component("TestDB3")
+
+    @pytest.mark.dependency(depends=["add_get_feature"])
+    @pytest.mark.parametrize(
+        "with_dataset, number_expected",
+        [
+            pytest.param(False, 3, id="All organisms"),
+            pytest.param(True, 2, id="Organisms with datasets"),
+        ],
+    )
+    def test_list_organisms(
+        self,
+        data_dir: Path,
+        engine: Engine,
+        shared_orgs_file: Path,
+        with_dataset: bool,
+        number_expected: int,
+    ) -> None:
+        """Test listing organisms, optionally only those with datasets."""
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json")
+
+        organisms = reg.list_organisms(with_dataset=with_dataset)
+        assert len(organisms) == number_expected
+
+    def test_iter_components_counts(self, data_dir: Path, engine: Engine, shared_orgs_file: Path) -> None:
+        """Test counting the organisms and datasets of each component in one query."""
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json")
+        reg.add_component("EmptyDB")
+
+        counts = [(row.name, row.organisms, row.datasets) for row in reg.iter_components_counts()]
+        expected = [
+            (comp.name, len(comp.organisms), sum(len(org.datasets) for org in comp.organisms))
+            for comp in reg.list_components()
+        ]
+        assert counts == expected
+
+    @pytest.mark.parametrize("component, with_dataset", [(None, False), (None, True), ("TestDB2", False)])
+    def test_iter_organisms_counts(
+        self,
+        data_dir: Path,
+        engine: Engine,
+        shared_orgs_file: Path,
+        component: Optional[str],
+        with_dataset: bool,
+    ) -> None:
+        """Test counting the datasets of each organism in one query."""
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json")
+
+        counts = [
+            "\t".join([row.component, row.abbrev, f"({row.datasets} datasets)"])
+            for row in reg.iter_organisms_counts(component, with_dataset)
+        ]
+        expected = [str(org) for org in reg.list_organisms(component, with_dataset)]
+        assert counts
+        assert counts == expected
+
     @pytest.mark.dependency(name="load_datasets")
     @pytest.mark.parametrize(
         "dataset_file, release, expectation",
@@ -220,6 +338,7 @@ class Test_RNASeqRegistry:
             pytest.param(
                 "datasets_same_name_same_org.json", 10, raises(IntegrityError), id="2 datasets same name"
             ),
+            pytest.param("datasets_invalid.json", 10, raises(ValidationError), id="Invalid dataset"),
         ],
     )
     def test_load_datasets(
@@ -239,82 +358,162 @@ class Test_RNASeqRegistry:
         with expectation:
             assert reg.load_datasets(data_dir / dataset_file, release=release)
 
+    @pytest.mark.dependency(depends=["load_datasets"])
+    @pytest.mark.parametrize(
+        "batch_size, organism_inserts, accession_inserts, expectation",
+        [
+            pytest.param(None, 1, 1, does_not_raise(), id="All rows at once"),
+            pytest.param(2, 2, 2, does_not_raise(), id="Two rows per insert"),
+            pytest.param(1, 3, 3, does_not_raise(), id="One row per insert"),
+            pytest.param(0, 0, 0, raises(ValueError), id="Invalid batch size"),
+        ],
+    )
+    def test_load_batch_size(
+        self,
+        data_dir: Path,
+        engine: Engine,
+        shared_orgs_file: Path,
+        batch_size: Optional[int],
+        organism_inserts: int,
+        accession_inserts: int,
+        expectation: ContextManager,
+    ) -> None:
+        """Test loading organisms and datasets with small insert batches."""
+
+        inserts: Counter = Counter()
+
+        def count_inserts(_conn, _cursor, statement: str, *_args) -> None:
+            if statement.startswith("INSERT INTO"):
+                inserts[statement.split()[2]] += 1
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        event.listen(engine, "before_cursor_execute", count_inserts)
+        with expectation:
+            reg.load_organisms(shared_orgs_file, batch_size=batch_size)
+            assert reg.load_datasets(data_dir / "datasets_several.json", batch_size=batch_size) == 3
+            datasets = reg.list_datasets()
+            expected = json.loads((data_dir / "datasets_several.json").read_text())
+            assert sorted(len(dataset.samples) for dataset in datasets) == sorted(
+                len(dataset["runs"]) for dataset in expected
+            )
+        assert inserts["organism"] == organism_inserts
+        assert inserts["accession"] == accession_inserts
+
+    @pytest.mark.dependency(depends=["load_datasets"])
+    @pytest.mark.parametrize(
+        "replace, ignore, loaded_expected, retired_expected",
+        [
+            pytest.param(False, False, 0, 0, id="Duplicates not loaded"),
+            pytest.param(False, True, 0, 0, id="Duplicates ignored"),
+            pytest.param(True, False, 3, 3, id="Duplicates replaced"),
+        ],
+    )
+    def test_load_datasets_again(
+        self,
+        data_dir: Path,
+        engine: Engine,
+        shared_orgs_file: Path,
+        replace: bool,
+        ignore: bool,
+        loaded_expected: int,
+        retired_expected: int,
+    ) -> None:
+        """Test loading the same datasets a second time."""
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json", release=10)
+        loaded = reg.load_datasets(
+            data_dir / "datasets_several.json", release=11, replace=replace, ignore=ignore
+        )
+        assert loaded == loaded_expected
+
+        assert len(reg.list_datasets()) == 3
+        retired = reg.list_datasets(latest=False)
+        assert len(retired) == retired_expected
+        for dataset in retired:
+            assert dataset.retired == 11
+
+    @pytest.mark.dependency(depends=["load_datasets"])
+    def test_load_datasets_replace_failed(
+        self, data_dir: Path, engine: Engine, shared_orgs_file: Path
+    ) -> None:
+        """Test that a failed replacement leaves the current datasets untouched."""
+
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json", release=10)
+        with raises(IntegrityError):
+            reg.load_datasets(data_dir / "datasets_several_duplicated.json", release=11, replace=True)
+
+        assert len(reg.list_datasets()) == 3
+        assert not reg.list_datasets(latest=False)
+
     @pytest.mark.dependency(name="list_datasets")
     @pytest.mark.parametrize(
-        "datasets_file, component, organism, dataset, in_release, out_release, number_expected, expectation",
+        "component, organism, dataset, out_release, number_expected, expectation",
         [
             pytest.param(
-                "datasets_several.json",
                 None,
                 None,
                 None,
-                10,
                 None,
                 3,
                 does_not_raise(),
                 id="Get all datasets",
             ),
             pytest.param(
-                "datasets_several.json",
                 None,
                 None,
                 None,
                 10,
-                10,
                 3,
                 does_not_raise(),
                 id="Get all datasets for this release",
             ),
             pytest.param(
-                "datasets_several.json",
                 None,
                 "speciesA",
                 "dataset_A1",
-                10,
                 None,
                 1,
                 does_not_raise(),
                 id="Get 1 exact dataset",
             ),
             pytest.param(
-                "datasets_several.json",
                 None,
                 "speciesA",
                 None,
-                10,
                 None,
                 2,
                 does_not_raise(),
                 id="Datasets for 1 species",
             ),
             pytest.param(
-                "datasets_several.json",
                 "TestDB",
                 None,
                 None,
-                10,
                 None,
                 3,
                 does_not_raise(),
                 id="Datasets for 1 component",
             ),
             pytest.param(
-                "datasets_several.json",
                 "NoDB",
                 None,
                 None,
-                10,
                 None,
                 0,
                 does_not_raise(),
                 id="Unknown component",
             ),
             pytest.param(
-                "datasets_several.json",
                 "TestDB",
                 "LOREM",
                 None,
-                10,
                 None,
                 0,
                 does_not_raise(),
@@ -324,28 +523,17 @@ class Test_RNASeqRegistry:
     )
     def test_list_datasets(
         self,
-        data_dir: Path,
-        engine: Engine,
-        shared_orgs_file: Path,
-        datasets_file: Path,
+        several_datasets_reg: RnaseqRegistry,
         component: str,
         organism: str,
         dataset: str,
-        in_release: Optional[int],
         out_release: Optional[int],
         number_expected: int,
         expectation: ContextManager,
     ) -> None:
         """Test getting a filtered list of datasets."""
 
-        reg = RnaseqRegistry(engine)
-        reg.create_db()
-        reg.load_organisms(shared_orgs_file)
-
-        if in_release is not None:
-            reg.load_datasets(data_dir / datasets_file, release=in_release)
-        else:
-            reg.load_datasets(data_dir / datasets_file)
+        reg = several_datasets_reg
         with expectation:
             datasets = reg.list_datasets(
                 component=component, organism=organism, dataset_name=dataset, release=out_release
@@ -383,6 +571,54 @@ class Test_RNASeqRegistry:
         for dataset in datasets:
             reg.remove_dataset(dataset)
 
+    @pytest.mark.dependency(depends=["remove_dataset"])
+    @pytest.mark.parametrize(
+        "organism_name, remaining_num",
+        [
+            pytest.param("speciesA", 1, id="Remove the datasets of one organism"),
+            pytest.param(None, 0, id="Remove all datasets"),
+        ],
+    )
+    def test_remove_datasets(
+        self,
+        data_dir: Path,
+        engine: Engine,
+        shared_orgs_file: Path,
+        organism_name: Optional[str],
+        remaining_num: int,
+    ) -> None:
+        """Test removing several datasets at once, with their samples and accessions."""
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json")
+
+        reg.remove_datasets(reg.list_datasets(organism=organism_name))
+        remaining = reg.list_datasets()
+        assert len(remaining) == remaining_num
+        # No orphan samples or accessions left
+        remaining_samples = [sample for dataset in remaining for sample in dataset.samples]
+        remaining_accessions = [acc for sample in remaining_samples for acc in sample.accessions]
+        assert reg.session.scalar(select(func.count(Sample.id))) == len(remaining_samples)
+        assert reg.session.scalar(select(func.count(Accession.id))) == len(remaining_accessions)
+
+    @pytest.mark.dependency(depends=["load_datasets"])
+    def test_paged_in_lists(
+        self, data_dir: Path, engine: Engine, shared_orgs_file: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Test loading, replacing and removing datasets with one value per IN list."""
+        monkeypatch.setattr(api, "_IN_PAGE_SIZE", 1)
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_several.json", release=10)
+        assert reg.load_datasets(data_dir / "datasets_several.json", release=11, replace=True) == 3
+
+        assert len(reg.list_datasets(latest=False, release=10)) == 3
+        reg.remove_datasets(reg.list_datasets(latest=None))
+        assert not reg.list_datasets(latest=None)
+        assert reg.session.scalar(select(func.count(Sample.id))) == 0
+
     @pytest.mark.dependency(depends=["list_datasets"])
     @pytest.mark.parametrize(
         "organism_name, dataset_name, expectation",
@@ -470,6 +706,22 @@ class Test_RNASeqRegistry:
             after_remap_org_from = reg.list_datasets(organism=org_from)
             assert len(after_remap_org_from) == 0
 
+    @pytest.mark.dependency(depends=["remap_feature"])
+    def test_remap_failed(self, engine: Engine, data_dir: Path, shared_orgs_file: Path) -> None:
+        """Test that a remap that fails does not leave the source datasets retired."""
+        reg = RnaseqRegistry(engine)
+        reg.create_db()
+        reg.load_organisms(shared_orgs_file)
+        reg.load_datasets(data_dir / "datasets_same_name_ok.json")
+
+        # speciesA already has a current dataset_A1
+        with raises(IntegrityError):
+            reg.remap("speciesB", "speciesA", 1, True)
+        reg.add_component("NewDB")
+
+        assert len(reg.list_datasets()) == 2
+        assert not reg.list_datasets(latest=False)
+
     @pytest.mark.dependency(name="dump_datasets", depends=["list_datasets"])
     @pytest.mark.parametrize(
         "datasets_file, expected_dumped_file, expectation",
@@ -510,6 +762,11 @@ class Test_RNASeqRegistry:
             reg.dump_datasets(dumped_path, datasets)
             assert_files(dumped_path, data_dir / expected_dumped_file)
 
+            # Same output when the datasets are streamed from the database
+            streamed_path = tmp_path / "output_dump_streamed.json"
+            reg.dump_datasets(streamed_path, reg.iter_datasets(release=release))
+            assert_files(streamed_path, data_dir / expected_dumped_file)
+
     @pytest.mark.dependency(depends=["list_datasets"])
     @pytest.mark.parametrize(
         "datasets_file",
@@ -546,3 +803,4 @@ class Test_RNASeqRegistry:
             file_path = folder_path / f"{dataset.organism.abbrev}_{dataset.name}.json"
             # Assert file were created
             assert file_path.exists()
+            assert json.loads(file_path.read_text()) == dataset.to_json_struct()
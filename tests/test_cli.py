@@ -0,0 +1,58 @@
+# See the NOTICE file distributed with this work for additional information
+# regarding copyright ownership.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Unit tests for the RNA-Seq registry command line interface.
+"""
+import logging
+from pathlib import Path
+
+import pytest
+
+from ensembl.rnaseq.registry import cli
+
+
+def test_run_cli_twice(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test that consecutive runs on the same database reuse its engine and set their own log level."""
+    db = tmp_path / "registry.db"
+    try:
+        cli.run_cli(["--verbose", "create", str(db)])
+        engine = cli.get_engine(db)
+        assert logging.getLogger().level == logging.INFO
+
+        cli.run_cli(["component", str(db), "--add", "TestDB"])
+        assert cli.get_engine(db) is engine
+        assert logging.getLogger().level == logging.WARNING
+
+        cli.run_cli(["component", str(db), "--list"])
+        assert capsys.readouterr().out.endswith("TestDB\t(0 organisms)\t(0 datasets)\n")
+    finally:
+        cli._drop_engine(db)  # pylint: disable=protected-access
+
+
+def test_run_cli_recreated_db(tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+    """Test that a database deleted outside of the CLI is really created again."""
+    db = tmp_path / "registry.db"
+    try:
+        cli.run_cli(["create", str(db)])
+        cli.run_cli(["component", str(db), "--add", "A"])
+        db.unlink()
+
+        cli.run_cli(["create", str(db)])
+        assert db.is_file()
+        capsys.readouterr()
+        cli.run_cli(["component", str(db), "--list"])
+        assert capsys.readouterr().out == ""
+    finally:
+        cli._drop_engine(db)  # pylint: disable=protected-access